@@ -47,6 +47,9 @@ class Prediction:
         self.location = location
         self.data = 0
         self.apiKey = key
+        # successful getCloudAvg results, keyed by (day, sDAY) : repeated calls
+        # within the same day share one network fetch
+        self.cloud_cache = {}
 
     def setLocation(self, location):
         """Set location"""
@@ -55,6 +58,12 @@ class Prediction:
     def getCloudAvg(self, sDAY):
         """ Return percent Average of clouds, @ UTC 09:00:00, UTC 12:00:00, UTC 13:00:00"""
         """ Average : ((hour1+hour2+hour3)/3 """
+        cache_key = (datetime.date.today().isoformat(), sDAY)
+        if cache_key in self.cloud_cache:
+            avg = self.cloud_cache[cache_key]
+            debug(0, "[getCloudAvg] cached : {} % for {}".format(avg, cache_key))
+            return avg
+
         tHours = [3,4,5]
         clouds = 0
         try:
@@ -90,7 +99,10 @@ class Prediction:
             log(1,"[cloud_prediction] *** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
             log(1, e)
             return -1
-        return avg   
+        # only successful fetches are remembered, error codes must stay retryable
+        # and entries from previous days are dropped on the way
+        self.cloud_cache = {cache_key: avg}
+        return avg
 
     def getRawData(self):
         """Print JSON data returned by html request"""
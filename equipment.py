@@ -241,17 +241,17 @@ class VariablePowerEquipment(Equipment):
             else:
                 break
         i = mid + adj
-        print("Adj = " + str(adj)) if EDEBUG else ''
+        if EDEBUG: print("Adj = " + str(adj))
         if (i >= n): 
             return 100
         else:
             dist = self.power_tab[i] - self.power_tab[i-1]
-            print(dist)  if EDEBUG else ''
+            if EDEBUG: print(dist)
             r = 0.5 / (dist / (int(value) - self.power_tab[i-1] ))
-            print(r)  if EDEBUG else ''
-            print(str(self.power_tab[i]) + " - " + str(self.power_tab[i-1])) if EDEBUG else ''
-            print(str(i/2) + " - " + str((i-1)/2)) if EDEBUG else ''
-            print("i = " + str(i)) if EDEBUG else ''
+            if EDEBUG: print(r)
+            if EDEBUG: print(str(self.power_tab[i]) + " - " + str(self.power_tab[i-1]))
+            if EDEBUG: print(str(i/2) + " - " + str((i-1)/2))
+            if EDEBUG: print("i = " + str(i))
             return (((i-1)/2+r))
 
     def set_current_power(self, power):
@@ -296,9 +296,8 @@ class VariablePowerEquipment(Equipment):
         return decrease
 
     def increase_power_by(self, watt):
-        debug(4, "[PARENT: increase power by]") if EDEBUG else ''
-        debug(5, "{} currently {}, increase by {} W".format(self.name, self.current_power, int(watt))) if EDEBUG else ''
-        
+        if EDEBUG: debug(4, "[PARENT: increase power by]")
+        if EDEBUG: debug(5, "{} currently {}, increase by {} W".format(self.name, self.current_power, int(watt)))
         if self.current_power + watt >= self.MAX_POWER:
             increase = self.MAX_POWER - self.current_power
             remaining = watt - increase
@@ -309,7 +308,7 @@ class VariablePowerEquipment(Equipment):
             debug(4, "not increasing power because it doesn't reach the minimal power: "+str(self.MIN_POWER))
             increase = 0
             remaining = watt
-        debug(5, "increase {}, remaining {}".format(int(increase), int(remaining))) if EDEBUG else ''
+        if EDEBUG: debug(5, "increase {}, remaining {}".format(int(increase), int(remaining)))
         if increase == 0:
             debug(4, "status quo")
         elif increase > 0:
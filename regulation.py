@@ -34,8 +34,9 @@
 
 # See the "equipment module" for the definitions of the loads.
 
-import signal, sys, os, psutil, datetime, json, time
+import signal, sys, os, psutil, datetime, json, time, threading
 import paho.mqtt.client as mqtt
+import numpy as np
 
 from debug_log import log as log
 from debug_log import debug as debug
@@ -50,6 +51,20 @@ import configparser
 config = configparser.ConfigParser()
 config.read('config.ini')
 
+# orjson parses the fixed sensor payloads several times faster than the stdlib and
+# accepts bytes directly (no intermediate str), fall back on json when not installed
+try:
+    import orjson
+    def json_loads(payload):
+        return orjson.loads(payload)
+    def json_dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def json_loads(payload):
+        return json.loads(payload.decode())
+    def json_dumps(obj):
+        return json.dumps(obj)
+
 unset_words = ("none", "None", "NONE", "false", "False", "FALSE", "nok", "NOK")
 set_words = ("true", "True", "TRUE", "ok", "OK", )
 
@@ -99,6 +114,8 @@ power_production = None
 power_consumption = None
 status = None
 equipments = ()
+equipments_rev = ()
+equipments_by_name = {}
 equipment_water_heater = None
 
 ECS_energy_yesterday = 0
@@ -110,6 +127,36 @@ ECS_MODE = 20     # set to Domoticz value 20 wich is SOLAIRE_FEEDBACK widget lev
 PZEM_TIMEOUT = 30
 weather = Prediction(config['cloudForecast']['location'],config['cloudForecast']['key'])
 
+# Sensor messages only update the power values and raise this flag, the actual
+# regulation runs at most once per EVALUATION_PERIOD in regulation_worker().
+_dirty = False
+_state_lock = threading.Lock()
+
+# Latest-wins hand-over between paho's network thread and the regulation worker :
+# one slot per topic. A burst of messages on a topic collapses into the newest
+# payload, which is the only value the next evaluate() would use anyway.
+_latest_msgs = {}
+# Force commands are never coalesced : two back-to-back commands may address two
+# different equipments and both must be applied, so they queue up in order.
+_force_msgs = []
+_new_data = threading.Event()
+
+# Fingerprint of the last published status, used to skip identical publishes
+_last_status_key = None
+
+# The status dict allocated on first publish, then mutated in place : the dict and
+# its per-equipment sub-dicts survive across publishes
+_status_msg = None
+
+# localtime struct of the last evaluation, kept next to last_evaluation_date so the
+# scheduler can compare minute/hour fields without rebuilding datetime objects
+_last_eval_tm = None
+
+# Cloud forecast fetched ahead of the CHECK_AT fallback by weather_worker(), so
+# evaluate() never blocks on the weather server request
+_cloud_forecast_ready = None
+_cloud_lock = threading.Lock()
+
 ###############################################################
 # MQTT CONFIG
 mqtt_client = None
@@ -130,6 +177,22 @@ TOPIC_DOMOTICZ_IN = prefix + "domoticz/in"
 IDX_INJECTION = config['domoticz']['idx_injection']
 IDX_GRID = config['domoticz']['idx_grid']
 IDX_ECS_MODE = config['domoticz']['idx_ecs_mode']
+IDX_KEEP_ALIVE = "658"
+
+# Domoticz idx are numeric : validate them once at startup rather than
+# interpolating unchecked strings into JSON at publish time
+IDX_INJECTION = str(int(IDX_INJECTION))
+IDX_GRID = str(int(IDX_GRID))
+IDX_ECS_MODE = str(int(IDX_ECS_MODE))
+
+# Precomputed Domoticz payloads : the idx never changes at runtime so the JSON
+# skeleton is built once here instead of being concatenated on every evaluate()
+DOM_INJECTION_TMPL = "{ \"idx\": " + IDX_INJECTION + ", \"nvalue\": 0, \"svalue\": \"%d\"}"
+DOM_INJECTION_ZERO = DOM_INJECTION_TMPL % 0
+DOM_GRID_TMPL = "{ \"idx\": " + IDX_GRID + ", \"nvalue\": 0, \"svalue\": \"%d\"}"
+DOM_GRID_ZERO = DOM_GRID_TMPL % 0
+DOM_GETDEVICEINFO = "{ \"command\": \"getdeviceinfo\", \"idx\": " + IDX_ECS_MODE + "}"
+DOM_KEEP_ALIVE = "{ \"idx\": " + IDX_KEEP_ALIVE + ", \"nvalue\": 1}"
 
 if (config['domoticz']['send_domoticz'] in set_words): 
     SEND_DOMOTICZ = True 
@@ -190,10 +253,8 @@ def now_ts():
     return time.time()
 
 def get_equipment_by_name(name):
-    for e in equipments:
-        if e.name == name:
-            return e
-    return None
+    # equipments_by_name is built once in main(), the equipments list is static afterwards
+    return equipments_by_name.get(name)
 
 def on_connect(client, userdata, flags, rc):
     debug(0, "Connected to BROKER " + MQTT_BROKER )
@@ -212,96 +273,130 @@ def on_connect(client, userdata, flags, rc):
         if (e.topic_read_power != None):
             debug(1, "Subscribing " + str(e.topic_read_power))
 
-def on_message(client, userdata, msg):
+def payload_error(err, j):
+    # Bad payload reporting, shared by the narrow handlers in on_message. A payload
+    # carrying PZEM_READ_ERROR is a sensor read report, not a malformed message.
+    if isinstance(j, dict) and 'PZEM_READ_ERROR' in j:
+        if SDEBUG: print("************* [on message]         pzem error")
+        return
+    log(1, "*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
+    log(4, err)
+    log(4, j)
+    if SDEBUG: print("*** [on message]         error, message badly formated")
+    if SDEBUG: print("*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
+    if SDEBUG: print(err)
+    if SDEBUG: print(j)
+def handle_message(topic, payload):
     # Receive power consumption and production values and triggers the evaluation. We also take into account manual
     # control messages in case we want to turn on/off a given equipment.
+    # Runs on the regulation worker thread, fed by the latest-wins slots (and the
+    # force queue) filled in on_message.
+    # Only the payload parsing and field extraction run under try/except : keeping the
+    # dispatch and regulation logic out of the handler lets the interpreter specialize
+    # the hot bytecode and no longer hides unrelated errors.
     global power_production, power_consumption, last_production_date, last_consumption_date, production_energy
-    global PZEM_TIMEOUT, ECS_MODE
+    global PZEM_TIMEOUT, ECS_MODE, _dirty
 
-    print("[on message] topic : " + msg.topic) if SDEBUG else ''
+    if SDEBUG: print("[on message] topic : " + topic)
     now = now_ts()
+    # every subscribed topic carries a JSON payload
     try:
-        ##########
-        # TOPIC DETECTED IS : CONSUMTION
-        if msg.topic == TOPIC_SENSOR_CONSUMPTION:
-            print("[on message]         conso : " + str(power_consumption) + ", prod : " + str(power_production)) if SDEBUG else ''
-            j = json.loads(msg.payload.decode())
-            power_consumption = int(j['power'])
-            evaluate()
-            last_consumption_date = now
-        ##########
-        # TOPIC DETECTED IS : PRODUCTION
-        elif msg.topic == TOPIC_SENSOR_PRODUCTION:
-            print("[on message]         conso : " + str(power_consumption) + ", prod : " + str(power_production)) if SDEBUG else ''
-            j = json.loads(msg.payload.decode())
-            power_production = int(j['power'])
+        j = json_loads(payload)
+    except ValueError as err:
+        payload_error(err, payload)
+        return
+    ##########
+    # TOPIC DETECTED IS : CONSUMTION
+    if topic == TOPIC_SENSOR_CONSUMPTION:
+        if SDEBUG: print("[on message]         conso : " + str(power_consumption) + ", prod : " + str(power_production))
+        try:
+            power = int(j['power'])
+        except (KeyError, TypeError, ValueError) as err:
+            payload_error(err, j)
+            return
+        with _state_lock:
+            power_consumption = power
+            _dirty = True
+        last_consumption_date = now
+    ##########
+    # TOPIC DETECTED IS : PRODUCTION
+    elif topic == TOPIC_SENSOR_PRODUCTION:
+        if SDEBUG: print("[on message]         conso : " + str(power_consumption) + ", prod : " + str(power_production))
+        try:
+            power = int(j['power'])
+        except (KeyError, TypeError, ValueError) as err:
+            payload_error(err, j)
+            return
+        with _state_lock:
+            power_production = power
             if last_production_date is not None:
                 delta = now - last_production_date
                 if delta < PZEM_TIMEOUT:
                     production_energy += power_production * delta / 3600.0
             if SIMULATION and SIM_PROD is not None:
                 power_production = SIM_PROD
-            evaluate()
-            last_production_date = now
-        ##########
-        # TOPIC DETECTED IS : ECS_MODE
-        elif msg.topic == TOPIC_ECSMODE :
-            j = json.loads(msg.payload.decode())
+            _dirty = True
+        last_production_date = now
+    ##########
+    # TOPIC DETECTED IS : ECS_MODE
+    elif topic == TOPIC_ECSMODE :
+        try:
             ECS_MODE = int(j['svalue1'])
-            print("[on message]         ********************************** ECS_MODE : " + str(ECS_MODE)) if SDEBUG else ''
-        ##########
-        # TOPIC DETECTED IS : FORCE
-        elif msg.topic == TOPIC_FORCE: 
-            print("[on message]         Forcing...") if SDEBUG else ''
-            j = json.loads(msg.payload.decode())
+        except (KeyError, TypeError, ValueError) as err:
+            payload_error(err, j)
+            return
+        if SDEBUG: print("[on message]         ********************************** ECS_MODE : " + str(ECS_MODE))
+    ##########
+    # TOPIC DETECTED IS : FORCE
+    elif topic == TOPIC_FORCE:
+        if SDEBUG: print("[on message]         Forcing...")
+        try:
             command = j['command']
             name = j['name']
-            if command == 'force':
-                e = get_equipment_by_name(name)
-                if e:
-                    power = j['power']
-                    msg = 'forcing equipment {} to {}W'.format(name, power)
-                    duration = j.get('duration')  # duration is optional with default value None
-                    if duration:
-                        msg += ' for '+str(duration)+' seconds'
-                    else:
-                        msg += ' without time limitation'
-                    debug(0, '')
-                    debug(0, msg)
-                    e.force(power, duration)
-                    evaluate()
-            elif command == 'unforce':
-                e = get_equipment_by_name(name)
-                if e:
-                    debug(0, '')
-                    debug(0, 'not forcing equipment {} anymore'.format(name))
-                    e.force(None)
-                    evaluate()
-
-        ##########
-        # TOPIC DETECTED IS : unknown        
-        else: # This is a topic_read_power msg. Which equipment is 'over loaded'  ?
-            for e in equipments:
-                print("    Equipment : " + e.name)      if SDEBUG else ''   
-                print("        topic_read_power : '" + str(e.topic_read_power)+"'") if SDEBUG else ''   
-                print("        is_overed : " + str(e.is_overed()))      if SDEBUG else ''   
-                
-                if (e.topic_read_power is not None) and (not e.is_overed()):
-                    if (msg.topic == e.topic_read_power):
-                        print("            "+ e.name + " check over") if SDEBUG else ''
-                        j = json.loads(msg.payload.decode())
+            power = int(j['power']) if command == 'force' else None
+            duration = j.get('duration')  # duration is optional with default value None
+            if duration is not None:
+                duration = int(duration)
+        except (KeyError, TypeError, ValueError) as err:
+            payload_error(err, j)
+            return
+        if command == 'force':
+            e = get_equipment_by_name(name)
+            if e:
+                txt = 'forcing equipment {} to {}W'.format(name, power)
+                if duration:
+                    txt += ' for '+str(duration)+' seconds'
+                else:
+                    txt += ' without time limitation'
+                debug(0, '')
+                debug(0, txt)
+                e.force(power, duration)
+                with _state_lock:
+                    _dirty = True
+        elif command == 'unforce':
+            e = get_equipment_by_name(name)
+            if e:
+                debug(0, '')
+                debug(0, 'not forcing equipment {} anymore'.format(name))
+                e.force(None)
+                with _state_lock:
+                    _dirty = True
+
+    ##########
+    # TOPIC DETECTED IS : unknown
+    else: # This is a topic_read_power msg. Which equipment is 'over loaded'  ?
+        for e in equipments:
+            if SDEBUG: print("    Equipment : " + e.name)
+            if SDEBUG: print("        topic_read_power : '" + str(e.topic_read_power)+"'")
+            if SDEBUG: print("        is_overed : " + str(e.is_overed()))
+            if (e.topic_read_power is not None) and (not e.is_overed()):
+                if (topic == e.topic_read_power):
+                    if SDEBUG: print("            "+ e.name + " check over")
+                    try:
                         e.measured_power = int(j[e.json_read_power])
-    except Exception as e:
-        if 'PZEM_READ_ERROR' in j:
-            print("************* [on message]         pzem error") if SDEBUG else ''
-        else :
-            log(1, "*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
-            log(4, e)
-            log(4, j)
-            print("*** [on message]         error, message badly formated") if SDEBUG else ''
-            print("*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))  if SDEBUG else ''
-            print(e) if SDEBUG else ''
-            print(j) if SDEBUG else ''
+                    except (KeyError, TypeError, ValueError) as err:
+                        payload_error(err, j)
+                        return
 
 def signal_handler(sig, frame):
     """ End of program handler, set equipments 0W and save status"""
@@ -417,16 +512,14 @@ def get_season():
 def request_ECS_mode():  # domoticz request : does ECS is Jour/Nuit, Solaire_fallback, OFF   ?
     # Request Device Info
     # {"command": "getdeviceinfo", "idx": 2450 }
-    domoticz = "{ \"command\": \"getdeviceinfo\", \"idx\": " + IDX_ECS_MODE + "}"
-    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz) 
-    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
-
+    domoticz = DOM_GETDEVICEINFO
+    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
+    if SDEBUG: print(TOPIC_DOMOTICZ_IN, domoticz)
 def send_keep_alive():  # domoticz request : does ECS is Jour/Nuit, Solaire_fallback, OFF   ?
     # Send keep Alive to Domoticz Device
     # {"command": "getdeviceinfo", "idx": 2450 }
-    IDX_KEEP_ALIVE = "658"
-    domoticz = "{ \"idx\": " + IDX_KEEP_ALIVE + ", \"nvalue\": 1}"
-    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)    
+    domoticz = DOM_KEEP_ALIVE
+    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
     debug(0, TOPIC_DOMOTICZ_IN + domoticz)
     #print("###################################################################" + TOPIC_DOMOTICZ_IN + domoticz)
     
@@ -574,109 +667,127 @@ def evaluate():
     global power_production, power_consumption, last_production_date, last_consumption_date, status
     global last_grid_date, last_injection_date,last_zero_grid_date, last_zero_injection_date
     global SIM_FALLBACK, INIT_AT, INIT_AT_prev, CHECK_AT, CHECK_AT_prev, last_saveStatus_date, STATUS_TIME
-    TODAY = 0 
-    TOMORROW = 1
+    global _last_status_key, _last_eval_tm, _status_msg
 
-    try:
-        t = now_ts()
+    t = now_ts()
         
-        ##########
-        # SCHEDULER
-        if last_evaluation_date is not None: # Evaluating scheduler
+    ##########
+    # SCHEDULER
+    if last_evaluation_date is not None: # Evaluating scheduler
             
-            # ensure there's a minimum duration between two evaluations
-            if t - last_evaluation_date < EVALUATION_PERIOD:
-                return
+        # ensure there's a minimum duration between two evaluations
+        if t - last_evaluation_date < EVALUATION_PERIOD:
+            return
 
-            d1 = datetime.datetime.fromtimestamp(last_evaluation_date)
-            d2 = datetime.datetime.fromtimestamp(t)
+        # the scheduler only needs minute/hour fields : one localtime() call and the
+        # cached struct of the previous evaluation replace the two datetime objects
+        # that were previously allocated on every tick
+        tm1 = _last_eval_tm
+        tm2 = time.localtime(t)
 
-            if d1.minute == 20 and d2.minute == 21:  # every hours and 3 minutes (...14h03, 15h03...)
-                #print ("**************************************************************************")
-                send_keep_alive()  
+        if tm1.tm_min == 20 and tm2.tm_min == 21:  # every hours and 3 minutes (...14h03, 15h03...)
+            #print ("**************************************************************************")
+            send_keep_alive()  
                
-            if d1.hour == INIT_AT_prev and d2.hour == INIT_AT and not init_today: # ensure it's not already done for today
-                log(0,"[evaluate] ECS energy / Over : " + str(equipment_water_heater.get_energy()) + " / " + str(equipment_water_heater.is_overed()))
-                equipment_water_heater.unset_over() # maybe it has been forced this night (low_energy_fallback)
-                equipment_water_heater.reset_energy()
-                log(0,"           ECS energy / Over : " + str(equipment_water_heater.get_energy()) + " / " + str(equipment_water_heater.is_overed()))
-                fallback_today = False
-                init_today = True
-                return
-
-            if SIM_FALLBACK and not fallback_today:
-                fallback_today = True
-                print("Simulating low_energy_fallback...")
-                low_energy_fallback()
-
-            if d1.hour == CHECK_AT_prev and d2.hour == CHECK_AT and not fallback_today:  # fallback_today : ensure it's not already done for today
-            #if True and not fallback_today:  # fallback_today : be sure it's not already done for today
-                fallback_today = True
-                log(0,"------------------------------------------------------------")
-                log(0,"[evaluate] Past Cloud / Production / Water_heater")
-                log(8, "csv : {} ; {} ; {}".format(CLOUD_forecast, int(production_energy), ECS_energy_today) )
-                CLOUD_forecast = -1
-                retry = 0
-                while CLOUD_forecast < 0 and retry < 5:
-                    log(0,"[evaluate] Cloud request : " + str(retry))
-                    retry = retry + 1
-                    if (CHECK_AT > 7 and CHECK_AT < 24):
-                        log(0,"[evaluate] Cloud Forecast Tomorrow : " + str(CLOUD_forecast))
-                        CLOUD_forecast = weather.getCloudAvg(TOMORROW)
-                    elif (CHECK_AT >= 0):
-                        log(0,"[evaluate] Cloud Forecast Today : " + str(CLOUD_forecast))
-                        CLOUD_forecast = weather.getCloudAvg(TODAY)
-                    time.sleep(5) # Delays for 5 seconds
-                log(0,"[evaluate] Cloud forcast : " + str(CLOUD_forecast))
-                if (CLOUD_forecast == -404):
-                    log(0,"*** cannot contact weather server")
-                    log(4,"FORCING CLOUD Forecast to 100 %")  
-                    CLOUD_forecast = 100 
-                elif (CLOUD_forecast == -1):
-                    log(0,"*** cloudForecast is out of range")
-                    log(4,"FORCING CLOUD Forecast to 100 %")   
-                    CLOUD_forecast = 100 
-
-                ECS_energy_today = equipment_water_heater.get_energy()
-                equipment_water_heater.reset_energy()
-                production_energy = 0
-                # ensure that water stays warm enough
-                low_energy_fallback()
-                init_today = False
-                return
-
-        ##########
-        last_evaluation_date = t
-        if power_production is None or power_consumption is None: # Return if None
+        if tm1.tm_hour == INIT_AT_prev and tm2.tm_hour == INIT_AT and not init_today: # ensure it's not already done for today
+            log(0,"[evaluate] ECS energy / Over : " + str(equipment_water_heater.get_energy()) + " / " + str(equipment_water_heater.is_overed()))
+            equipment_water_heater.unset_over() # maybe it has been forced this night (low_energy_fallback)
+            equipment_water_heater.reset_energy()
+            log(0,"           ECS energy / Over : " + str(equipment_water_heater.get_energy()) + " / " + str(equipment_water_heater.is_overed()))
+            fallback_today = False
+            init_today = True
+            return
+
+        if SIM_FALLBACK and not fallback_today:
+            fallback_today = True
+            print("Simulating low_energy_fallback...")
+            low_energy_fallback()
+
+        if tm1.tm_hour == CHECK_AT_prev and tm2.tm_hour == CHECK_AT and not fallback_today:  # fallback_today : ensure it's not already done for today
+        #if True and not fallback_today:  # fallback_today : be sure it's not already done for today
+            fallback_today = True
+            log(0,"------------------------------------------------------------")
+            log(0,"[evaluate] Past Cloud / Production / Water_heater")
+            log(8, "csv : {} ; {} ; {}".format(CLOUD_forecast, int(production_energy), ECS_energy_today) )
+            # the forecast has been fetched in background by weather_worker(),
+            # evaluate() only reads the cached value and never waits on the network
+            with _cloud_lock:
+                CLOUD_forecast = _cloud_forecast_ready
+            if CLOUD_forecast is None:
+                CLOUD_forecast = -404
+            log(0,"[evaluate] Cloud forcast : " + str(CLOUD_forecast))
+            if (CLOUD_forecast == -404):
+                log(0,"*** cannot contact weather server")
+                log(4,"FORCING CLOUD Forecast to 100 %")  
+                CLOUD_forecast = 100 
+            elif (CLOUD_forecast == -1):
+                log(0,"*** cloudForecast is out of range")
+                log(4,"FORCING CLOUD Forecast to 100 %")   
+                CLOUD_forecast = 100 
+
+            ECS_energy_today = equipment_water_heater.get_energy()
+            equipment_water_heater.reset_energy()
+            production_energy = 0
+            # ensure that water stays warm enough
+            low_energy_fallback()
+            init_today = False
             return
-        if last_consumption_date is None or last_production_date is None:
-            return  
-
-        debug(0, '')
-        debug(0, '[evaluate] evaluating power CONS = {}, PROD = {}'.format(power_consumption, power_production))
-        debug(0, '[evaluate] ECS Energy today {}'.format(equipment_water_heater.get_energy()))
-
-        ##########
-        # IS PZEM TIMEOUT ?
-        if (t - last_consumption_date) > PZEM_TIMEOUT or (t- last_production_date) > PZEM_TIMEOUT:
-                power_consumption = 0
-                power_production = 0
-                delta_cons = int(t - last_consumption_date)
-                delta_prod = int(t - last_production_date )
-                log(0, "*** MQTT RX : PZEM CONSUMPTION ({}s) OR PRODUCTION ({}s) TIMEOUT".format(delta_cons, delta_prod))
-                log(4, "reset all power equipments to 0")
-                for e in equipments:
-                    if e.is_forced():
-                        log(8, "skipping {} because it's forced".format(e.name))
-                    else:
-                        e.set_current_power(0)
-        ##########
-        # REAL WORK
-        else:
-            # HERE STARTS THE REAL WORK, compare powers
 
+    ##########
+    last_evaluation_date = t
+    _last_eval_tm = time.localtime(t)
+    if power_production is None or power_consumption is None: # Return if None
+        return
+    if last_consumption_date is None or last_production_date is None:
+        return  
+
+    debug(0, '')
+    debug(0, '[evaluate] evaluating power CONS = {}, PROD = {}'.format(power_consumption, power_production))
+    debug(0, '[evaluate] ECS Energy today {}'.format(equipment_water_heater.get_energy()))
+
+    ##########
+    # IS PZEM TIMEOUT ?
+    if (t - last_consumption_date) > PZEM_TIMEOUT or (t- last_production_date) > PZEM_TIMEOUT:
+            power_consumption = 0
+            power_production = 0
+            delta_cons = int(t - last_consumption_date)
+            delta_prod = int(t - last_production_date )
+            log(0, "*** MQTT RX : PZEM CONSUMPTION ({}s) OR PRODUCTION ({}s) TIMEOUT".format(delta_cons, delta_prod))
+            log(4, "reset all power equipments to 0")
+            for e in equipments:
+                if e.is_forced():
+                    log(8, "skipping {} because it's forced".format(e.name))
+                else:
+                    e.set_current_power(0)
+    ##########
+    # REAL WORK
+    else:
+        # HERE STARTS THE REAL WORK, compare powers
+
+        # Statically specialized path for the common single-equipment deployment
+        # (just the water heater) : no priority loops, no snapshot, no recovery
+        # pass, direct calls on the only equipment. The generic code below stays
+        # the reference implementation for larger configurations.
+        if len(equipments) == 1:
+            e = equipments[0]
+            if e.measured_power is not None:
+                e.check_over()
+            if power_consumption > (power_production - MARGIN):
+                excess_power = power_consumption - (power_production - MARGIN)
+                debug(0, "[evaluate] decreasing global power consumption by {}W".format(excess_power))
+                if not e.is_overed() and not e.is_forced():
+                    e.decrease_power_by(excess_power)
+            elif (power_production - MARGIN - power_consumption) < BALANCE_THRESHOLD:
+                # Nice, this is the goal: CONSUMPTION is EQUAL to PRODUCTION
+                debug(0, "[evaluate] power consumption and production are balanced")
+            else: # There's PV POWER IN EXCESS, try to increase the load
+                available_power = power_production - MARGIN - power_consumption
+                debug(0, "[evaluate] increasing global power consumption by {}W".format(available_power))
+                if not e.is_overed() and not e.is_forced():
+                    e.increase_power_by(available_power)
+        else:
             # Check which equipment is over
-            for e in reversed(equipments):
+            for e in equipments_rev:
                 if e.measured_power is not None:
                     e.check_over()
 
@@ -684,7 +795,7 @@ def evaluate():
             if power_consumption > (power_production - MARGIN): 
                 excess_power = power_consumption - (power_production - MARGIN)
                 debug(0, "[evaluate] decreasing global power consumption by {}W".format(excess_power))
-                for e in reversed(equipments):
+                for e in equipments_rev:
                     debug(2, "1. examining " + e.name)
                     if e.is_overed():
                         debug(4, "skipping this equipment because it's already full loaded for today")
@@ -733,22 +844,28 @@ def evaluate():
                     elif result < 0:
                         debug(2, "not enough available power to turn on this equipment, trying to recover power on lower priority equipments")
          
-                        freeable_power = 0
+                        # snapshot forced state and current power once : both loops below
+                        # used to re-query is_forced()/get_current_power() on every pass.
+                        snap = [(o, o.is_forced(), o.get_current_power()) for o in equipments]
                         needed_power = -result
-                        for j in range(i + 1, len(equipments)):
-                            o = equipments[j]
-                            if o.is_forced():
-                                continue
-                            p = o.get_current_power()
-                            if p is not None:
-                                freeable_power += p
+                        if len(snap) >= 8:
+                            # the vectorized struct-of-arrays sum only pays off on larger
+                            # fleets, building the arrays costs more than a loop at n=1-3
+                            powers_arr = np.fromiter((0 if p is None else p for (o, forced, p) in snap), dtype=np.int32, count=len(snap))
+                            forced_arr = np.fromiter((forced for (o, forced, p) in snap), dtype=bool, count=len(snap))
+                            freeable_power = int(np.where(forced_arr[i + 1:], 0, powers_arr[i + 1:]).sum())
+                        else:
+                            freeable_power = 0
+                            for o, forced, p in snap[i + 1:]:
+                                if not forced and p is not None:
+                                    freeable_power += p
                         debug(2, "power used by other equipments: {}W, needed: {}W".format(freeable_power, needed_power))
                         if freeable_power >= needed_power:
                             debug(2, "recovering power")
                             freed_power = 0
                             for j in reversed(range(i + 1, len(equipments))):
-                                o = equipments[j]
-                                if o.is_forced():
+                                o, forced, p = snap[j]
+                                if forced:
                                     continue
                                 result = o.decrease_power_by(needed_power)
                                 freed_power += result
@@ -766,115 +883,226 @@ def evaluate():
                         debug(2, "there is {}W left to use, continuing".format(available_power))
                 debug(2, "no more equipment to check")
         
-        ##########
-        # DOMOTICZ COMMUNICATION
-        if SEND_DOMOTICZ: # THEN SEND GRID & INJECTION MESSAGE
-            injection = (power_consumption - power_production) 
-            if injection < 0:   # This is INJECTION
-                grid = 0
-                last_injection_date = t
-            else:               # This is GRID
-                grid = injection
-                injection = 0
-                last_grid_date = t
-            #print ("***** SIMULATION DOMOTICZ INJECTION GRID : {} {} {} {}".format(SIMULATION, SEND_DOMOTICZ, SEND_INJECTION, SEND_GRID)) if SDEBUG else ''
-            ### HERE Prepare and send  INJECTION MESSAGE
-            if SEND_INJECTION:
-                if injection < 0 and last_injection == 0 and (t - last_injection_date) > 20 : 
-                    # This Workaround is needed in order to improve Grafana Integral calculation. Send 0.
-                    domoticz = "{ \"idx\": " + IDX_INJECTION + ", \"nvalue\": 0, \"svalue\": \"0\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz) 
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
-                if injection < 0:
-                    domoticz = "{ \"idx\": " + IDX_INJECTION + ", \"nvalue\": 0, \"svalue\": \"" + str(injection) + "\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz) 
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
+    ##########
+    # DOMOTICZ COMMUNICATION
+    domoticz_batch = []  # collected here, flushed with the status publish below
+    if SEND_DOMOTICZ: # THEN SEND GRID & INJECTION MESSAGE
+        injection = (power_consumption - power_production) 
+        if injection < 0:   # This is INJECTION
+            grid = 0
+            last_injection_date = t
+        else:               # This is GRID
+            grid = injection
+            injection = 0
+            last_grid_date = t
+        #print ("***** SIMULATION DOMOTICZ INJECTION GRID : {} {} {} {}".format(SIMULATION, SEND_DOMOTICZ, SEND_INJECTION, SEND_GRID)) if SDEBUG else ''
+        ### HERE Prepare and send  INJECTION MESSAGE
+        if SEND_INJECTION:
+            if injection < 0 and last_injection == 0 and (t - last_injection_date) > 20 : 
+                # This Workaround is needed in order to improve Grafana Integral calculation. Send 0.
+                domoticz = DOM_INJECTION_ZERO
+                domoticz_batch.append(domoticz)
+            if injection < 0:
+                domoticz = DOM_INJECTION_TMPL % injection
+                domoticz_batch.append(domoticz)
             
-                if injection == 0 and last_injection == 0:
-                    # Do not repeat this point 
-                    pass
-                elif injection == 0:
-                    domoticz = "{ \"idx\": " + IDX_INJECTION + ", \"nvalue\": 0, \"svalue\": \"0\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz) 
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
+            if injection == 0 and last_injection == 0:
+                # Do not repeat this point 
+                pass
+            elif injection == 0:
+                domoticz = DOM_INJECTION_ZERO
+                domoticz_batch.append(domoticz)
                     
-            ### HERE Prepare and send  GRID MESSAGE
-            if SEND_GRID:
-                if grid > 0 and last_grid == 0 and (t - last_grid_date) > 20 : 
-                    # This Workaround is needed to improve Grafana Integral calculation. Send 0.
-                    domoticz = "{ \"idx\": " + IDX_GRID + ", \"nvalue\": 0, \"svalue\": \"0\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
-                if grid > 0:
-                    domoticz = "{ \"idx\": " + IDX_GRID + ", \"nvalue\": 0, \"svalue\": \"" + str(grid) + "\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
-
-                if grid == 0 and last_grid == 0:
-                    # Do not repeat this point if last zero grid is not older than 30min (this is a keepalive for Domoticz)
-                    if (t - last_zero_grid_date > 1800 ):
-                        domoticz = "{ \"idx\": " + IDX_GRID + ", \"nvalue\": 0, \"svalue\": \"0\"}"
-                        mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
-                        print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
-                        last_zero_grid_date = t
-                elif grid == 0:
-                    domoticz = "{ \"idx\": " + IDX_GRID + ", \"nvalue\": 0, \"svalue\": \"0\"}"
-                    mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz)
-                    print(TOPIC_DOMOTICZ_IN, domoticz) if SDEBUG else ''
+        ### HERE Prepare and send  GRID MESSAGE
+        if SEND_GRID:
+            if grid > 0 and last_grid == 0 and (t - last_grid_date) > 20 : 
+                # This Workaround is needed to improve Grafana Integral calculation. Send 0.
+                domoticz = DOM_GRID_ZERO
+                domoticz_batch.append(domoticz)
+            if grid > 0:
+                domoticz = DOM_GRID_TMPL % grid
+                domoticz_batch.append(domoticz)
+
+            if grid == 0 and last_grid == 0:
+                # Do not repeat this point if last zero grid is not older than 30min (this is a keepalive for Domoticz)
+                if (t - last_zero_grid_date > 1800 ):
+                    domoticz = DOM_GRID_ZERO
+                    domoticz_batch.append(domoticz)
                     last_zero_grid_date = t
-            print("[evaluate]                    CALCULATED INJECTION :", injection) if SDEBUG else ''
-            print("[evaluate]                    CALCULATED GRID      :", grid) if SDEBUG else ''        
-            last_injection = injection
-            last_grid = grid
+            elif grid == 0:
+                domoticz = DOM_GRID_ZERO
+                domoticz_batch.append(domoticz)
+                last_zero_grid_date = t
+        if SDEBUG: print("[evaluate]                    CALCULATED INJECTION :", injection)
+        if SDEBUG: print("[evaluate]                    CALCULATED GRID      :", grid)
+        last_injection = injection
+        last_grid = grid
   
-        ##########
-        # Build an MQTT status message, and status file
-        status = None
-        msg = {
-            'date': int(t),
-            'date_str': datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S'),
-            'power_consumption': power_consumption,
-            'power_production': power_production,
-            'production_energy': round(production_energy),
-            'injection' : injection,
-            'grid' : grid,
-            'CLOUD_forecast' : CLOUD_forecast,
-            'ECS_energy_yesterday' : int(ECS_energy_yesterday),
-        }
+    ##########
+    # Send everything for this tick back to back : queueing the Domoticz
+    # samples right next to the status publish lets paho flush them to the
+    # broker in a single network write burst instead of scattered ones.
+    for domoticz in domoticz_batch:
+        mqtt_client.publish(TOPIC_DOMOTICZ_IN, domoticz, qos=0, retain=False)
+        if SDEBUG: print(TOPIC_DOMOTICZ_IN, domoticz)
+    ##########
+    # Build an MQTT status message, and status file
+    # Only publish when something actually changed since the last tick, this avoids
+    # serializing and sending the very same status again on every idle period.
+    status_key = (power_consumption, power_production, injection, grid,
+                  round(production_energy), CLOUD_forecast, int(ECS_energy_yesterday),
+                  tuple((e.get_current_power(), e.get_energy(), e.is_overed(), e.is_forced()) for e in equipments))
+    if status_key != _last_status_key:
+        _last_status_key = status_key
+        msg = _status_msg
+        if msg is None:
+            msg = {
+                'date': 0,
+                'date_str': '',
+                'power_consumption': 0,
+                'power_production': 0,
+                'production_energy': 0,
+                'injection' : 0,
+                'grid' : 0,
+                'CLOUD_forecast' : None,
+                'ECS_energy_yesterday' : 0,
+                'power_equipments': 0,
+                'power_house': 0,
+                'equipments': [{'name': e.name, 'current_power': 0, 'energy': 0, 'overed': False, 'forced': False} for e in equipments],
+            }
+            _status_msg = msg
+        msg['date'] = int(t)
+        # _last_eval_tm already holds localtime(t) for this tick, no need to
+        # build a datetime object just for the formatting
+        msg['date_str'] = time.strftime('%Y-%m-%d %H:%M:%S', _last_eval_tm)
+        msg['power_consumption'] = power_consumption
+        msg['power_production'] = power_production
+        msg['production_energy'] = round(production_energy)
+        msg['injection'] = injection
+        msg['grid'] = grid
+        msg['CLOUD_forecast'] = CLOUD_forecast
+        msg['ECS_energy_yesterday'] = int(ECS_energy_yesterday)
         power_equipments = 0
-        eq = []
-        for e in equipments:
-            p = int(e.get_current_power())       
-            power_equipments = power_equipments + p             
-            eq.append({
-                'name': e.name,
-                'current_power': 'unknown' if p is None else p,
-                'energy': e.get_energy(),
-                'overed' : e.is_overed(),
-                'forced': e.is_forced()
-            })
+        for e, eq in zip(equipments, msg['equipments']):
+            p = int(e.get_current_power())
+            power_equipments = power_equipments + p
+            eq['current_power'] = 'unknown' if p is None else p
+            eq['energy'] = e.get_energy()
+            eq['overed'] = e.is_overed()
+            eq['forced'] = e.is_forced()
         msg['power_equipments'] = power_equipments
         msg['power_house'] = power_consumption - power_equipments
-        msg['equipments'] = eq
         status = msg
-        mqtt_client.publish(TOPIC_STATUS, json.dumps(msg))
-        if last_saveStatus_date is None:
+        # telemetry is fire-and-forget : explicit QoS 0 / no retain avoids any
+        # broker handshake or stale retained status after a restart
+        mqtt_client.publish(TOPIC_STATUS, json_dumps(msg), qos=0, retain=False)
+    if last_saveStatus_date is None:
+        last_saveStatus_date = t
+    else:
+        if t - last_saveStatus_date > STATUS_TIME and STATUS_TIME >= 60:
+            saveStatus()    
             last_saveStatus_date = t
+
+
+def weather_worker():
+    # Fetch the cloud forecast in background shortly before the CHECK_AT fallback
+    # check. The blocking weather request (with its retries and 5s delays) used to
+    # run inside evaluate(), stalling the regulation loop for up to ~25 seconds.
+    global _cloud_forecast_ready
+    first = True
+    while True:
+        now = datetime.datetime.now()
+        # wake up during the hour preceding CHECK_AT so the value is ready in time
+        target = now.replace(hour=CHECK_AT_prev, minute=30, second=0, microsecond=0)
+        if target <= now:
+            target += datetime.timedelta(days=1)
+        # next CHECK_AT boundary this fetch has to serve
+        boundary = now.replace(hour=CHECK_AT, minute=0, second=0, microsecond=0)
+        if boundary <= now:
+            boundary += datetime.timedelta(days=1)
+        if first and boundary < target:
+            # started inside the CHECK_AT_prev:30 -> CHECK_AT:00 window : the check
+            # comes before the scheduled wake-up, fetch right away
+            log(0,"[weather_worker] check imminent, fetching now")
         else:
-            if t - last_saveStatus_date > STATUS_TIME and STATUS_TIME >= 60:
-                saveStatus()    
-                last_saveStatus_date = t
+            time.sleep((target - now).total_seconds())
+            boundary = target + datetime.timedelta(minutes=30)
+        first = False
+        # an evening CHECK_AT looks at the day after, and a midnight check reads the
+        # day starting at the boundary : from 23:30 (CHECK_AT = 0) that day is
+        # TOMORROW here too, not TODAY
+        if (CHECK_AT > 7 and CHECK_AT < 24) or boundary.date() > datetime.date.today():
+            forecast_day = TOMORROW
+        else:
+            forecast_day = cloud_prediction.TODAY
+        forecast = -1
+        retry = 0
+        while forecast < 0 and retry < 5:
+            log(0,"[weather_worker] Cloud request : " + str(retry))
+            retry = retry + 1
+            forecast = weather.getCloudAvg(forecast_day)
+            time.sleep(5) # Delays for 5 seconds
+        log(0,"[weather_worker] Cloud forecast fetched : " + str(forecast))
+        with _cloud_lock:
+            _cloud_forecast_ready = forecast
 
-    except Exception as e:
-        log(0,"[evaluate exception]") 
-        log(1, "*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
-        log(1, e)
+def on_message(client, userdata, msg):
+    # paho's network thread must stay free to read and write the socket : it only
+    # stores the payload in the latest-wins slot of its topic and wakes the worker.
+    # Force commands go to their own queue instead, every one of them matters.
+    with _state_lock:
+        if msg.topic == TOPIC_FORCE:
+            _force_msgs.append(msg.payload)
+        else:
+            _latest_msgs[msg.topic] = msg.payload
+    _new_data.set()
+
+def regulation_worker():
+    # Consumes the latest-wins slots filled by on_message and runs the regulation,
+    # all out of paho's network thread. Sensors publish every ~4s each on their own
+    # topic : evaluate() still runs at most once per EVALUATION_PERIOD thanks to the
+    # dirty flag raised by handle_message(), no matter how many messages arrived.
+    global _dirty
+    deadline = time.monotonic() + EVALUATION_PERIOD
+    while True:
+        timeout = deadline - time.monotonic()
+        if timeout > 0:
+            _new_data.wait(timeout=timeout)
+        _new_data.clear()
+        with _state_lock:
+            pending = list(_latest_msgs.items())
+            _latest_msgs.clear()
+            pending.extend((TOPIC_FORCE, payload) for payload in _force_msgs)
+            del _force_msgs[:]
+        for topic, payload in pending:
+            # same log-and-continue net as evaluate() below : a message must never
+            # kill the worker thread, regulation has to survive it
+            try:
+                handle_message(topic, payload)
+            except Exception as e:
+                log(0,"[handle_message exception]")
+                log(1, "*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
+                log(1, e)
+        if time.monotonic() >= deadline:
+            deadline = time.monotonic() + EVALUATION_PERIOD
+            with _state_lock:
+                dirty = _dirty
+                _dirty = False
+            if dirty:
+                # the safety net lives here, outside the hot evaluate() bytecode, so a
+                # regulation error is logged without killing the worker thread
+                try:
+                    evaluate()
+                except Exception as e:
+                    log(0,"[evaluate exception]")
+                    log(1, "*** Error on line {}".format(sys.exc_info()[-1].tb_lineno))
+                    log(1, e)
 
 ###############################################################
 # MAIN
 
 def main():
-    global mqtt_client, equipments, equipment_water_heater
+    global mqtt_client, equipments, equipments_rev, equipments_by_name, equipment_water_heater
     signal.signal(signal.SIGINT, signal_handler) 
     signal.signal(signal.SIGHUP, signal_handler) 
     signal.signal(signal.SIGUSR1, signal_handler)
@@ -917,7 +1145,13 @@ def main():
             continue
         
     #equipment_water_heater = VariablePowerEquipment('ECS')
-    
+
+    # name lookup table, used by the force/unforce messages (equipments never change afterwards)
+    equipments_by_name = {e.name: e for e in equipments}
+    # lowest priority first, used by the decrease scans in evaluate() : storing the
+    # already-reversed tuple avoids building a reverse iterator on every tick
+    equipments_rev = tuple(reversed(equipments))
+
     log(0, "Equipments :")
     # At startup, reset everything - Mandatory !
     for eq in equipments:
@@ -934,12 +1168,19 @@ def main():
         
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
+    threading.Thread(target=regulation_worker, daemon=True).start()
+    threading.Thread(target=weather_worker, daemon=True).start()
+    mqtt_client.reconnect_delay_set(min_delay=1, max_delay=60)
     try:
         mqtt_client.connect(MQTT_BROKER, PORT , 120)
     except:
         print("Cannot connect " + MQTT_BROKER)
         sys.exit()
-    mqtt_client.loop_forever()
+    # loop_start() runs the network I/O on its own thread so queued publishes are
+    # flushed promptly even while the evaluation worker is busy
+    mqtt_client.loop_start()
+    while True:
+        time.sleep(60)
 
 if __name__ == '__main__':
     main()